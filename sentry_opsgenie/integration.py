@@ -23,6 +23,8 @@ from opsgenie import OpsGenie
 from opsgenie import Configuration as OpsgenieConfiguration
 from opsgenie import GetAccountRequest
 
+from .stats import get_send_stats
+
 DESCRIPTION = """
 Connect your Sentry organization to your Opsgenie app, and start
 getting alerts for errors right in front of you where all the
@@ -177,6 +179,49 @@ class OpsgenieIntegration(IntegrationInstallation):
                 )
         return OpsGenie(config)
 
+    def get_health_stats(self):
+        # Recent send outcomes recorded by the notify action on any worker
+        return get_send_stats(self.model.id)
+
+    def get_organization_config(self):
+        # read-only fields, shown on the integration settings panel
+        return [
+            {
+                'name': name,
+                'type': 'string',
+                'label': label,
+                'help': help,
+                'disabled': True,
+            } for name, label, help in HEALTH_FIELDS
+        ]
+
+    def get_config_data(self):
+        config = dict(super(OpsgenieIntegration, self).get_config_data() or {})
+        stats = self.get_health_stats()
+        config.update({
+            'send_rate': format_stat(stats['send_rate'], u'{:.2f} sends/s'),
+            'success_ratio': format_stat(stats['success_ratio'], u'{:.1%}'),
+            'error_ratio': format_stat(stats['error_ratio'], u'{:.1%}'),
+            'latency_p50': format_stat(stats['latency_p50'], u'{:.0f} ms', scale=1000),
+            'latency_p99': format_stat(stats['latency_p99'], u'{:.0f} ms', scale=1000),
+            'rate_limited': u'{}'.format(stats['rate_limited']),
+        })
+        return config
+
+HEALTH_FIELDS = (
+    ('send_rate', _('Send rate'), _('Sends to Opsgenie per second over the last 5 minutes, rule firings coalesced into one alert count once.')),
+    ('success_ratio', _('Success ratio'), _('Share of sends accepted by Opsgenie in the last 5 minutes.')),
+    ('error_ratio', _('Error ratio'), _('Share of sends that failed in the last 5 minutes, including rate limited ones.')),
+    ('latency_p50', _('Latency p50'), _('Median create_alert latency over the last 5 minutes.')),
+    ('latency_p99', _('Latency p99'), _('99th percentile create_alert latency over the last 5 minutes.')),
+    ('rate_limited', _('Rate limit hits'), _('Sends rejected by Opsgenie with HTTP 429 in the last 5 minutes.')),
+)
+
+def format_stat(value, fmt, scale=1):
+    if value is None:
+        return u'n/a'
+    return fmt.format(value * scale)
+
 class OpsgenieIntegrationProvider(IntegrationProvider):
     """
     An integration provider describes a third party that can be registered within Sentry.
@@ -0,0 +1,441 @@
+from __future__ import absolute_import, print_function
+
+import gc
+import json
+import logging
+import os
+import threading
+import time
+import urlparse
+import uuid
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sentry.models import Event, Group, Integration, Project, Rule
+from sentry.rules.processor import RuleFuture
+from sentry.utils.samples import load_data
+
+from opsgenie import OpsGenie
+from opsgenie import Configuration as OpsgenieConfiguration
+
+from sentry_opsgenie import notify_action
+from sentry_opsgenie.integration import OpsgenieIntegration
+from sentry_opsgenie.notify_action import OpsgenieNotifyServiceAction
+from sentry_opsgenie.stats import is_rate_limited, percentile
+
+# synthetic issues get ids far above anything a real installation reaches,
+# so lookups keyed on them (assignees and such) never match real rows
+SYNTHETIC_GROUP_ID = 2 ** 62
+SYNTHETIC_GROUPS = 10
+
+# sent instead of the integration's api key unless --use-stored-key is given
+PLACEHOLDER_API_KEY = 'opsgenie-replay'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Opsgenie alert api the way the real service does, optionally
+    adding latency and rejecting requests above a per second limit with 429.
+    """
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length') or 0))
+
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            second = int(time.time())
+            if second != server.current_second:
+                server.current_second = second
+                server.requests_this_second = 0
+            server.requests_this_second += 1
+            limited = server.rate_limit and server.requests_this_second > server.rate_limit
+
+        if limited:
+            self.respond(429, {'message': 'You are making too many requests!'})
+        else:
+            self.respond(202, {'result': 'Request will be processed'})
+
+    def respond(self, status, body):
+        body.update({'took': 0.0, 'requestId': str(uuid.uuid4())})
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0, rate_limit=0):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.current_second = None
+        self.requests_this_second = 0
+
+
+class Command(BaseCommand):
+    args = '<project_id> <integration_id>'
+    help = ('Replays recorded or synthetic events through the Opsgenie alert '
+            'rule action against a local Opsgenie stand-in and reports throughput, '
+            'per-stage latency, database queries per send and memory growth. '
+            'Futures of --rules rules are coalesced by key the way the rule processor '
+            'does. Nothing is written to the project; synthetic events are built in memory.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', default=100,
+                    help='Number of events to replay.'),
+        make_option('--rate', type='float', default=0,
+                    help='Target events per second, 0 replays as fast as possible.'),
+        make_option('--rules', type='int', default=1,
+                    help='Number of rules firing the Opsgenie action for each event.'),
+        make_option('--synthetic', action='store_true', default=False,
+                    help='Generate in-memory sample events instead of replaying recorded ones.'),
+        make_option('--team-id', default=None),
+        make_option('--user-id', default=None),
+        make_option('--priority', default=None),
+        make_option('--tags', default=''),
+        make_option('--api-url', default=None,
+                    help='Send to this url instead of starting the built-in stand-in.'),
+        make_option('--use-stored-key', action='store_true', default=False,
+                    help='Send the integration\'s real api key instead of a placeholder.'),
+        make_option('--stand-in-latency', type='float', default=0,
+                    help='Milliseconds the built-in stand-in waits before answering.'),
+        make_option('--stand-in-rate-limit', type='int', default=0,
+                    help='Requests per second the built-in stand-in accepts before answering 429.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: opsgenie_replay %s' % self.args)
+
+        try:
+            project_id, integration_id = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError('Project and integration ids must be integers')
+
+        if options['count'] <= 0:
+            raise CommandError('--count must be a positive number')
+        if options['rules'] <= 0:
+            raise CommandError('--rules must be a positive number')
+        if options['rate'] < 0:
+            raise CommandError('--rate can not be negative')
+
+        try:
+            project = Project.objects.get(id=project_id)
+        except Project.DoesNotExist:
+            raise CommandError('Project %s does not exist' % project_id)
+
+        try:
+            integration = Integration.objects.get(
+                provider='opsgenie',
+                organizations=project.organization,
+                id=integration_id,
+            )
+        except Integration.DoesNotExist:
+            raise CommandError('Opsgenie integration %s is not installed for this project\'s organization'
+                               % integration_id)
+
+        if options['synthetic']:
+            events = synthetic_events(project, options['count'])
+        else:
+            events = recorded_events(project, options['count'])
+        if not events:
+            raise CommandError('No events to replay, record some or use --synthetic')
+
+        server = None
+        api_url = options['api_url']
+        if api_url is None:
+            server = StandInServer(
+                ('127.0.0.1', 0),
+                latency=options['stand_in_latency'] / 1000.0,
+                rate_limit=options['stand_in_rate_limit'],
+            )
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            api_url = 'http://127.0.0.1:%d/v2' % server.server_address[1]
+        elif not 'v1' in api_url and not 'v2' in api_url:
+            # same as the installation form
+            api_url = urlparse.urljoin(api_url, '/v2')
+
+        data = {
+            'account': integration.id,
+            'team_id': options['team_id'],
+            'user_id': options['user_id'],
+            'priority': options['priority'],
+            'tags': options['tags'],
+        }
+        actions = []
+        for i in range(options['rules']):
+            rule = Rule(project=project, label='Opsgenie replay %d' % (i + 1))
+            actions.append((rule, OpsgenieNotifyServiceAction(project, data=data, rule=rule)))
+
+        try:
+            with SendPathProbe(api_url, use_stored_key=options['use_stored_key']) as probe:
+                report = self.replay(actions, probe, events, options['count'], options['rate'])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        if not report['sends']:
+            raise CommandError('None of the %d replayed events produced an alert, '
+                               'their issues are probably ignored' % report['skipped'])
+
+        self.print_report(report, api_url)
+
+    def replay(self, actions, probe, events, count, rate):
+        rule_timings = []
+        send_timings = []
+        rule_queries = 0
+        send_queries = 0
+        skipped = 0
+        firings = 0
+        sends = 0
+        interval = 1.0 / rate if rate else 0
+
+        rss_before = current_rss()
+        gc.collect()
+        objects_before = len(gc.get_objects())
+        started = time.time()
+
+        for i in range(count):
+            if interval:
+                delay = started + i * interval - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            event = events[i % len(events)]
+
+            # group futures by key like RuleProcessor.apply, each stage is
+            # timed inside its own query capture so entering and leaving the
+            # capture is not part of the measured latency
+            grouped_futures = {}
+            with CaptureQueriesContext(connection) as captured:
+                stage_start = time.time()
+                for rule, action in actions:
+                    for future in action.after(event, state=None):
+                        key = future.key if future.key is not None else future.callback
+                        rule_future = RuleFuture(rule=rule, kwargs=future.kwargs)
+                        if key not in grouped_futures:
+                            grouped_futures[key] = (future.callback, [rule_future])
+                        else:
+                            grouped_futures[key][1].append(rule_future)
+                rule_timings.append(time.time() - stage_start)
+            rule_queries += len(captured)
+
+            if not grouped_futures:
+                # the rule action bails out on ignored issues
+                skipped += 1
+                continue
+
+            for callback, futures in grouped_futures.itervalues():
+                with CaptureQueriesContext(connection) as captured:
+                    stage_start = time.time()
+                    callback(event, futures)
+                    send_timings.append(time.time() - stage_start)
+                send_queries += len(captured)
+                firings += len(futures)
+                sends += 1
+
+        elapsed = time.time() - started
+        gc.collect()
+        objects_after = len(gc.get_objects())
+        rss_after = current_rss()
+
+        return {
+            'count': count,
+            'firings': firings,
+            'sends': sends,
+            'skipped': skipped,
+            'elapsed': elapsed,
+            'rule': sorted(rule_timings),
+            'send': sorted(send_timings),
+            'build': sorted(probe.build_timings),
+            'create_alert': sorted(probe.create_alert_timings),
+            'rule_queries': rule_queries,
+            'send_queries': send_queries,
+            'build_queries': probe.build_queries,
+            'errors': probe.errors,
+            'rate_limited': probe.rate_limited,
+            'rss_growth': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'object_growth': objects_after - objects_before,
+        }
+
+    def print_report(self, report, api_url):
+        sends = report['sends']
+        elapsed = report['elapsed']
+
+        self.stdout.write('Replayed %d events to %s in %.2fs' % (report['count'], api_url, elapsed))
+        if report['skipped']:
+            self.stdout.write('  skipped:        %d events produced no alert (ignored issue)' % report['skipped'])
+        self.stdout.write('  coalescing:     %d rule firings sent as %d alerts' % (report['firings'], sends))
+        self.stdout.write('  throughput:     %.2f alerts/s' % (sends / elapsed if elapsed else 0))
+        self.stdout.write('  rule stage:     %s' % format_latencies(report['rule']))
+        self.stdout.write('  send stage:     %s' % format_latencies(report['send']))
+        self.stdout.write('    build:        %s' % format_latencies(report['build']))
+        self.stdout.write('    create_alert: %s' % format_latencies(report['create_alert']))
+        self.stdout.write('  db queries:     %.2f per alert (rule %.2f, send %.2f, of which build %.2f)' % (
+            float(report['rule_queries'] + report['send_queries']) / sends,
+            float(report['rule_queries']) / sends,
+            float(report['send_queries']) / sends,
+            float(report['build_queries']) / sends,
+        ))
+        self.stdout.write('  memory growth:  %s rss, %d objects' % (
+            '%d KB' % (report['rss_growth'] / 1024) if report['rss_growth'] is not None else 'n/a',
+            report['object_growth'],
+        ))
+        self.stdout.write('  failed:         %d (%d rate limited)' % (report['errors'], report['rate_limited']))
+
+
+class SendPathProbe(object):
+    """
+    Instruments the notify action's send path for the duration of the
+    replay: clients point at ``api_url`` with a placeholder api key unless
+    ``use_stored_key`` is set, ``build_alert_payload`` and ``create_alert``
+    are timed, and the integration's health stats are left alone so replay
+    traffic does not show up on its settings panel.
+    """
+    def __init__(self, api_url, use_stored_key=False):
+        self.api_url = api_url
+        self.use_stored_key = use_stored_key
+        self.build_timings = []
+        self.build_queries = 0
+        self.create_alert_timings = []
+        self.errors = 0
+        self.rate_limited = 0
+
+    def __enter__(self):
+        self.originals = (
+            OpsgenieIntegration.get_client,
+            notify_action.build_alert_payload,
+            notify_action.record_send,
+        )
+        build_alert_payload = notify_action.build_alert_payload
+        probe = self
+
+        def timed_build_alert_payload(*args, **kwargs):
+            # runs inside the send stage's query capture
+            queries = len(connection.queries)
+            started = time.time()
+            try:
+                return build_alert_payload(*args, **kwargs)
+            finally:
+                probe.build_timings.append(time.time() - started)
+                probe.build_queries += len(connection.queries) - queries
+
+        def get_client(installation):
+            client = OpsGenie(OpsgenieConfiguration(
+                apikey=installation.model.metadata['api_key'] if probe.use_stored_key else PLACEHOLDER_API_KEY,
+                endpoint=probe.api_url,
+            ))
+            create_alert = client.alerts.create_alert
+
+            def timed_create_alert(*args, **kwargs):
+                started = time.time()
+                try:
+                    return create_alert(*args, **kwargs)
+                except Exception as e:
+                    probe.errors += 1
+                    if is_rate_limited(e):
+                        probe.rate_limited += 1
+                    raise
+                finally:
+                    probe.create_alert_timings.append(time.time() - started)
+
+            client.alerts.create_alert = timed_create_alert
+            return client
+
+        OpsgenieIntegration.get_client = get_client
+        notify_action.build_alert_payload = timed_build_alert_payload
+        notify_action.record_send = lambda *args, **kwargs: None
+        return self
+
+    def __exit__(self, *exc_info):
+        (OpsgenieIntegration.get_client,
+         notify_action.build_alert_payload,
+         notify_action.record_send) = self.originals
+
+
+def recorded_events(project, count):
+    events = list(Event.objects.filter(project_id=project.id).order_by('-datetime')[:count])
+    Event.objects.bind_nodes(events, 'data')
+    return events
+
+
+def synthetic_events(project, count):
+    """
+    Build unsaved sample events spread over a handful of unsaved issues,
+    nothing is written to the project.
+    """
+    sample = load_data('python')
+    sample.setdefault('tags', [['level', 'error']])
+
+    groups = {}
+    events = []
+    for i in range(count):
+        now = timezone.now()
+        event = Event(
+            project_id=project.id,
+            event_id=uuid.uuid4().hex,
+            message=sample.get('message', ''),
+            platform='python',
+            datetime=now,
+            data=dict(sample),
+        )
+
+        index = i % SYNTHETIC_GROUPS
+        group = groups.get(index)
+        if group is None:
+            group = groups[index] = Group(
+                id=SYNTHETIC_GROUP_ID + index,
+                project=project,
+                message=event.message,
+                culprit=sample.get('culprit', ''),
+                level=logging.ERROR,
+                first_seen=now,
+                last_seen=now,
+                data={
+                    'type': event.get_event_type(),
+                    'metadata': event.get_event_metadata(),
+                },
+            )
+
+        event.group = group
+        events.append(event)
+    return events
+
+
+def current_rss():
+    # resident set size in bytes, None where /proc isn't available
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def format_ms(value):
+    if value is None:
+        return 'n/a'
+    return '%.1fms' % (value * 1000)
+
+
+def format_latencies(values):
+    return 'p50 %s  p99 %s' % (format_ms(percentile(values, 50)), format_ms(percentile(values, 99)))
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import time
+
 from django import forms
 from django.utils.translation import ugettext_lazy as _
 
@@ -11,6 +13,9 @@ from opsgenie import GetTeamRequest
 from opsgenie import GetUserRequest
 
 from .utils import ( build_alert_payload, LEVEL_TO_PRIORITY )
+from .stats import (
+    record_send, is_rate_limited, OUTCOME_SUCCESS, OUTCOME_ERROR, OUTCOME_RATE_LIMITED,
+)
 
 class OpsgenieNotifyServiceForm(forms.Form):
     account = forms.ChoiceField(choices=(), widget=forms.Select())
@@ -147,15 +152,25 @@ class OpsgenieNotifyServiceAction(EventAction):
             return
 
         def send_alert(event, futures):
-            rules = [f.rule for f in futures]
-            payload = build_alert_payload(event.group, team_id, user_id, priority, event=event, tags=tags, rules=rules)
+            try:
+                rules = [f.rule for f in futures]
+                payload = build_alert_payload(event.group, team_id, user_id, priority, event=event, tags=tags, rules=rules)
 
-            client = integration.get_installation(organization_id=self.project.organization.id).get_client()
+                client = integration.get_installation(organization_id=self.project.organization.id).get_client()
+            except Exception:
+                # count the failed send, the rule processor logs the error
+                record_send(integration.id, OUTCOME_ERROR)
+                raise
 
+            started = time.time()
             try:
                 client.alerts.create_alert(payload)
             except Exception as e:
+                record_send(integration.id, OUTCOME_RATE_LIMITED if is_rate_limited(e) else OUTCOME_ERROR,
+                            latency=time.time() - started)
                 self.logger.info('rule.fail.opsgenie_post', extra={'error': e.message})
+            else:
+                record_send(integration.id, OUTCOME_SUCCESS, latency=time.time() - started)
 
         key = u'opsgenie:{}:{}:{}'.format(integration_id, team_id, user_id)
 
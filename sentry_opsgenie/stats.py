@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+import logging
+import time
+
+from sentry.utils import redis
+
+logger = logging.getLogger('sentry.integrations.opsgenie')
+
+# number of recent send outcomes remembered per integration
+BUFFER_SIZE = 1000
+# trailing window, in seconds, the rate and ratios are computed over
+WINDOW = 300
+# keys of integrations that stop sending expire after a week
+KEY_TTL = 60 * 60 * 24 * 7
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_ERROR = 'error'
+OUTCOME_RATE_LIMITED = 'rate_limited'
+
+
+def get_client(integration_id):
+    return redis.clusters.get('default').get_local_client_for_key(outcomes_key(integration_id))
+
+
+def outcomes_key(integration_id):
+    return u'opsgenie:outcomes:{}'.format(integration_id)
+
+
+def record_send(integration_id, outcome, latency=None):
+    """
+    Push the outcome of a send onto the integration's capped redis list,
+    in one round trip. Futures coalesced into one send count once.
+    ``latency`` is the ``create_alert`` duration, None if the send failed
+    before reaching Opsgenie.
+    """
+    entry = '%f:%s:%s' % (time.time(), '' if latency is None else '%f' % latency, outcome)
+    try:
+        pipe = get_client(integration_id).pipeline(transaction=False)
+        pipe.lpush(outcomes_key(integration_id), entry)
+        pipe.ltrim(outcomes_key(integration_id), 0, BUFFER_SIZE - 1)
+        pipe.expire(outcomes_key(integration_id), KEY_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('opsgenie.stats.record_failed', extra={'error': e.message})
+
+
+def get_send_stats(integration_id):
+    """
+    Summarize the sends of the last ``WINDOW`` seconds, as recorded by
+    every worker. Returns an empty summary if redis can't be read.
+    """
+    now = time.time()
+    try:
+        entries = get_client(integration_id).lrange(outcomes_key(integration_id), 0, -1)
+    except Exception as e:
+        logger.warning('opsgenie.stats.read_failed', extra={'error': e.message})
+        return summarize([], now)
+
+    outcomes = []
+    for entry in entries:
+        ts, latency, outcome = entry.split(':', 2)
+        if now - float(ts) <= WINDOW:
+            outcomes.append((float(ts), float(latency) if latency else None, outcome))
+
+    return summarize(outcomes, now, saturated=len(entries) >= BUFFER_SIZE)
+
+
+def summarize(outcomes, now, saturated=False):
+    total = len(outcomes)
+    counts = {
+        OUTCOME_SUCCESS: 0,
+        OUTCOME_ERROR: 0,
+        OUTCOME_RATE_LIMITED: 0,
+    }
+    for _, _, outcome in outcomes:
+        counts[outcome] += 1
+
+    latencies = sorted(latency for _, latency, _ in outcomes if latency is not None)
+
+    # once the buffer is full its oldest entry may be younger than the
+    # window, in which case the rate is only known since that entry
+    span = WINDOW
+    if saturated and outcomes:
+        span = min(WINDOW, now - min(ts for ts, _, _ in outcomes)) or WINDOW
+
+    return {
+        'sent': total,
+        'send_rate': float(total) / span,
+        'success_ratio': float(counts[OUTCOME_SUCCESS]) / total if total else None,
+        'error_ratio': float(counts[OUTCOME_ERROR] + counts[OUTCOME_RATE_LIMITED]) / total if total else None,
+        'rate_limited': counts[OUTCOME_RATE_LIMITED],
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+    }
+
+
+def percentile(values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def is_rate_limited(error):
+    # the opsgenie client raises ApiException carrying the http status
+    return getattr(error, 'status', None) == 429